@@ -9,80 +9,344 @@
 import sys
 import socket
 import subprocess
-import platform
 import os
+import struct
 
-# Настраиваем кодировку вывода для Windows
-if sys.platform == 'win32':
-    import codecs
-    sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
-    sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
+try:
+    import ctypes
+    from ctypes import wintypes
+except ImportError:
+    ctypes = None
+
+# Платформа определяется один раз при загрузке модуля
+_IS_WINDOWS = sys.platform == 'win32'
+_IS_LINUX = sys.platform.startswith('linux')
+
+# Константы IP Helper API (Windows)
+AF_INET = 2
+AF_INET6 = 23
+TCP_TABLE_OWNER_PID_LISTENER = 3
+MIB_TCP_STATE_LISTEN = 2
+ERROR_INSUFFICIENT_BUFFER = 122
+NO_ERROR = 0
+
+if ctypes is not None:
+    class MIB_TCPROW_OWNER_PID(ctypes.Structure):
+        """Строка таблицы TCP-соединений с PID владельца"""
+        _fields_ = [
+            ('dwState', wintypes.DWORD),
+            ('dwLocalAddr', wintypes.DWORD),
+            ('dwLocalPort', wintypes.DWORD),
+            ('dwRemoteAddr', wintypes.DWORD),
+            ('dwRemotePort', wintypes.DWORD),
+            ('dwOwningPid', wintypes.DWORD),
+        ]
+    
+    class MIB_TCP6ROW_OWNER_PID(ctypes.Structure):
+        """Строка таблицы TCPv6-соединений с PID владельца"""
+        _fields_ = [
+            ('ucLocalAddr', ctypes.c_ubyte * 16),
+            ('dwLocalScopeId', wintypes.DWORD),
+            ('dwLocalPort', wintypes.DWORD),
+            ('ucRemoteAddr', ctypes.c_ubyte * 16),
+            ('dwRemoteScopeId', wintypes.DWORD),
+            ('dwRemotePort', wintypes.DWORD),
+            ('dwState', wintypes.DWORD),
+            ('dwOwningPid', wintypes.DWORD),
+        ]
+
+def _get_tcp_listener_table(family=AF_INET):
+    """Возвращает список слушающих TCP-сокетов через GetExtendedTcpTable"""
+    iphlpapi = ctypes.WinDLL('iphlpapi')
+    size = wintypes.DWORD(0)
+    buf = None
+    
+    # Увеличиваем буфер, пока таблица в него не поместится
+    while True:
+        result = iphlpapi.GetExtendedTcpTable(
+            buf, ctypes.byref(size), False,
+            family, TCP_TABLE_OWNER_PID_LISTENER, 0
+        )
+        if result == NO_ERROR:
+            break
+        if result != ERROR_INSUFFICIENT_BUFFER:
+            raise OSError(result, "GetExtendedTcpTable завершился с ошибкой")
+        buf = ctypes.create_string_buffer(size.value)
+    
+    if buf is None:
+        return []
+    
+    # Таблица: DWORD dwNumEntries, затем массив строк MIB_TCP(6)ROW_OWNER_PID
+    row_type = MIB_TCP6ROW_OWNER_PID if family == AF_INET6 else MIB_TCPROW_OWNER_PID
+    num_entries = wintypes.DWORD.from_buffer(buf).value
+    row_array = row_type * num_entries
+    return row_array.from_buffer(buf, ctypes.sizeof(wintypes.DWORD))
+
+def _iter_listeners_windows():
+    """Перебирает (порт, PID) слушающих TCP-сокетов IPv4 и IPv6 (включая dual-stack [::])"""
+    for family in (AF_INET, AF_INET6):
+        for row in _get_tcp_listener_table(family):
+            if row.dwState == MIB_TCP_STATE_LISTEN:
+                yield socket.ntohs(row.dwLocalPort & 0xFFFF), row.dwOwningPid
+
+def _find_pid_windows(port):
+    """Находит PID слушающего процесса через IP Helper API"""
+    for local_port, pid in _iter_listeners_windows():
+        if local_port == port:
+            return pid
+    return None
+
+# Константы netlink SOCK_DIAG (Linux)
+NETLINK_SOCK_DIAG = 4
+SOCK_DIAG_BY_FAMILY = 20
+NLM_F_REQUEST = 0x01
+NLM_F_DUMP = 0x300
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+TCP_LISTEN = 10
+NLMSG_HEADER = struct.Struct('=IHHII')
+INET_DIAG_REQ_V2 = struct.Struct('=BBBBI48x')
+
+def _iter_listeners_netlink():
+    """Перебирает (порт, inode) слушающих TCP-сокетов через netlink SOCK_DIAG"""
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_SOCK_DIAG)
+    try:
+        for seq, family in enumerate((socket.AF_INET, socket.AF_INET6), 1):
+            request = INET_DIAG_REQ_V2.pack(family, socket.IPPROTO_TCP, 0, 0, 1 << TCP_LISTEN)
+            header = NLMSG_HEADER.pack(
+                NLMSG_HEADER.size + len(request), SOCK_DIAG_BY_FAMILY,
+                NLM_F_REQUEST | NLM_F_DUMP, seq, 0
+            )
+            sock.send(header + request)
+            
+            done = False
+            while not done:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                offset = 0
+                while offset + NLMSG_HEADER.size <= len(data):
+                    msg_len, msg_type, _, _, _ = NLMSG_HEADER.unpack_from(data, offset)
+                    if msg_type == NLMSG_DONE:
+                        done = True
+                        break
+                    if msg_type == NLMSG_ERROR:
+                        raise OSError("netlink вернул ошибку")
+                    # inet_diag_msg: idiag_sport по смещению 4, idiag_inode по смещению 68
+                    body = offset + NLMSG_HEADER.size
+                    sport, = struct.unpack_from('>H', data, body + 4)
+                    inode, = struct.unpack_from('=I', data, body + 68)
+                    yield sport, inode
+                    # Сообщения выровнены по 4 байта
+                    offset += (msg_len + 3) & ~3
+    finally:
+        sock.close()
+
+def _iter_listeners_proc():
+    """Перебирает (порт, inode) слушающих TCP-сокетов из /proc/net/tcp"""
+    for path in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(path) as f:
+                next(f)  # Пропускаем заголовок
+                for line in f:
+                    parts = line.split()
+                    if len(parts) > 9 and parts[3] == '0A':  # 0A = TCP_LISTEN
+                        yield int(parts[1].rsplit(':', 1)[1], 16), int(parts[9])
+        except OSError:
+            continue
+
+def _iter_listeners_linux():
+    """Перебирает слушающие сокеты: сначала netlink, при ошибке /proc/net/tcp"""
+    try:
+        return list(_iter_listeners_netlink())
+    except OSError:
+        return list(_iter_listeners_proc())
+
+def _find_pid_by_inode(inode):
+    """Находит PID процесса, владеющего сокетом с указанным inode"""
+    target = f'socket:[{inode}]'
+    for entry in os.scandir('/proc'):
+        if not entry.name.isdigit():
+            continue
+        fd_dir = f'/proc/{entry.name}/fd'
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue  # Процесс завершился или нет прав
+        for fd in fds:
+            try:
+                if os.readlink(f'{fd_dir}/{fd}') == target:
+                    return int(entry.name)
+            except OSError:
+                continue
+    return None
+
+def _find_pid_linux(port):
+    """Находит PID слушающего процесса через ядро без вызова lsof"""
+    for sport, inode in _iter_listeners_linux():
+        if sport == port and inode:
+            return _find_pid_by_inode(inode)
+    return None
+
+def get_listening_ports():
+    """Возвращает множество портов, на которых слушают TCP-сокеты (None, если не поддерживается)"""
+    if _IS_WINDOWS and ctypes is not None:
+        return {port for port, _ in _iter_listeners_windows()}
+    if _IS_LINUX:
+        return {port for port, _ in _iter_listeners_linux()}
+    return None
+
+def get_busy_ports(ports):
+    """Возвращает занятые порты из ports: по таблице сокетов, иначе пробным подключением"""
+    try:
+        listening = get_listening_ports()
+    except Exception:
+        listening = None
+    if listening is not None:
+        return {port for port in ports if port in listening}
+    
+    # Таблица сокетов недоступна (например, на Mac): подключаемся к каждому порту
+    busy = set()
+    for port in ports:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.settimeout(1)
+        try:
+            if sock.connect_ex(('localhost', port)) == 0:
+                busy.add(port)
+        finally:
+            sock.close()
+    return busy
+
+def is_port_in_use(port):
+    """Проверяет, слушает ли кто-нибудь порт"""
+    return port in get_busy_ports((port,))
 
 def find_process_on_port(port):
     """Находит процесс, использующий указанный порт"""
-    system = platform.system()
-    
-    if system == 'Windows':
-        # Windows: используем netstat и tasklist
+    if _IS_WINDOWS:
+        if ctypes is not None:
+            # Windows: запрашиваем таблицу TCP напрямую у ядра
+            try:
+                return _find_pid_windows(port)
+            except Exception as e:
+                print(f"Ошибка при поиске процесса: {e}")
+                return None
+        
+        # Запасной вариант без ctypes: используем netstat
         try:
             # Находим PID через netstat
             result = subprocess.run(
                 ['netstat', '-ano'],
                 capture_output=True,
-                text=True,
+                text=False,
                 timeout=10
             )
             
-            # Ищем строку с нашим портом
-            for line in result.stdout.split('\n'):
-                if f':{port}' in line and 'LISTENING' in line:
-                    parts = line.split()
-                    if len(parts) > 0:
-                        pid = parts[-1]
-                        if pid.isdigit():
-                            return int(pid)
+            # Ищем строку с нашим портом прямо в байтах, без декодирования всего вывода
+            needle = f':{port} '.encode()
+            for line in result.stdout.splitlines():
+                if needle in line and b'LISTENING' in line:
+                    pid = line.rsplit(None, 1)[-1]
+                    if pid.isdigit():
+                        return int(pid)
+        except Exception as e:
+            print(f"Ошибка при поиске процесса: {e}")
+            return None
+    elif _IS_LINUX:
+        # Linux: читаем таблицу сокетов из ядра и сопоставляем inode с /proc/*/fd
+        try:
+            return _find_pid_linux(port)
         except Exception as e:
             print(f"Ошибка при поиске процесса: {e}")
             return None
     else:
-        # Linux/Mac: используем lsof
+        # Mac: используем lsof (только слушающий сокет, без подключённых клиентов)
         try:
             result = subprocess.run(
-                ['lsof', '-ti', f':{port}'],
+                ['lsof', '-ti', f'tcp:{port}', '-sTCP:LISTEN'],
                 capture_output=True,
-                text=True,
+                text=False,
                 timeout=10
             )
-            if result.returncode == 0 and result.stdout.strip():
-                return int(result.stdout.strip())
+            pids = result.stdout.split()
+            if result.returncode == 0 and pids:
+                return int(pids[0])
         except FileNotFoundError:
-            print("lsof не найден. Установите его для работы на Linux/Mac.")
+            print("lsof не найден. Установите его для работы на Mac.")
         except Exception as e:
             print(f"Ошибка при поиске процесса: {e}")
             return None
     
     return None
 
+# Права доступа к процессу (Windows)
+PROCESS_TERMINATE = 0x0001
+PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+
+def _open_process(access, pid):
+    """Открывает дескриптор процесса через OpenProcess"""
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    # Явные сигнатуры, чтобы 64-битные дескрипторы не обрезались до int
+    kernel32.CloseHandle.argtypes = [wintypes.HANDLE]
+    kernel32.TerminateProcess.argtypes = [wintypes.HANDLE, wintypes.UINT]
+    kernel32.QueryFullProcessImageNameW.argtypes = [
+        wintypes.HANDLE, wintypes.DWORD, wintypes.LPWSTR, ctypes.POINTER(wintypes.DWORD)
+    ]
+    handle = kernel32.OpenProcess(access, False, pid)
+    if not handle:
+        raise ctypes.WinError(ctypes.get_last_error())
+    return kernel32, handle
+
+def _get_process_image_windows(pid):
+    """Возвращает полный путь к исполняемому файлу процесса"""
+    kernel32, handle = _open_process(PROCESS_QUERY_LIMITED_INFORMATION, pid)
+    try:
+        buf = ctypes.create_unicode_buffer(32768)
+        size = wintypes.DWORD(len(buf))
+        if not kernel32.QueryFullProcessImageNameW(handle, 0, buf, ctypes.byref(size)):
+            raise ctypes.WinError(ctypes.get_last_error())
+        return buf.value
+    finally:
+        kernel32.CloseHandle(handle)
+
+def _terminate_process_windows(pid):
+    """Завершает процесс через TerminateProcess"""
+    kernel32, handle = _open_process(PROCESS_TERMINATE, pid)
+    try:
+        return bool(kernel32.TerminateProcess(handle, 1))
+    finally:
+        kernel32.CloseHandle(handle)
+
 def get_process_info(pid):
     """Получает информацию о процессе"""
-    system = platform.system()
-    
-    if system == 'Windows':
+    if _IS_WINDOWS:
+        if ctypes is not None:
+            try:
+                path = _get_process_image_windows(pid)
+                return {
+                    'name': os.path.basename(path),
+                    'pid': pid,
+                    'path': path
+                }
+            except OSError:
+                pass  # Нет прав на открытие процесса, пробуем tasklist
         try:
             result = subprocess.run(
-                ['tasklist', '/FI', f'PID eq {pid}', '/FO', 'CSV', '/NH'],
+                ['tasklist', '/FI', f'PID eq {pid}', '/FO', 'LIST'],
                 capture_output=True,
                 text=True,
                 timeout=10
             )
-            if result.returncode == 0 and result.stdout.strip():
-                parts = result.stdout.strip().split('","')
-                if len(parts) >= 2:
-                    return {
-                        'name': parts[0].strip('"'),
-                        'pid': pid,
-                        'path': parts[-1].strip('"') if len(parts) > 1 else 'N/A'
-                    }
+            # Формат LIST: "Поле: значение" по строке на поле, без экранирования CSV
+            values = [line.split(':', 1)[1].strip()
+                      for line in result.stdout.splitlines() if ':' in line]
+            if result.returncode == 0 and len(values) >= 2 and values[1] == str(pid):
+                return {
+                    'name': values[0],
+                    'pid': pid,
+                    'path': 'N/A'
+                }
         except Exception as e:
             print(f"Ошибка при получении информации о процессе: {e}")
     else:
@@ -107,15 +371,15 @@ def get_process_info(pid):
 
 def kill_process(pid):
     """Завершает процесс"""
-    system = platform.system()
-    
     try:
-        if system == 'Windows':
+        if _IS_WINDOWS and ctypes is not None:
+            return _terminate_process_windows(pid)
+        elif _IS_WINDOWS:
             subprocess.run(['taskkill', '/F', '/PID', str(pid)], check=True, timeout=10)
         else:
             subprocess.run(['kill', '-9', str(pid)], check=True, timeout=10)
         return True
-    except subprocess.CalledProcessError:
+    except (subprocess.CalledProcessError, PermissionError):
         return False
     except Exception as e:
         print(f"Ошибка при завершении процесса: {e}")
@@ -131,42 +395,44 @@ def main():
     print("=" * 40)
     print("")
     
-    # Проверяем доступность порта
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(1)
-    result = sock.connect_ex(('localhost', port))
-    sock.close()
+    # Ищем процесс сразу: найденный PID означает, что порт занят
+    pid = find_process_on_port(port)
     
-    if result == 0:
-        # Порт занят, ищем процесс
-        print(f"[!] Порт {port} занят, ищем процесс...")
-        pid = find_process_on_port(port)
+    if pid is None:
+        # Владелец не найден: отличаем свободный порт от процесса без прав доступа
+        if is_port_in_use(port):
+            print(f"[!] Порт {port} занят, но не удалось найти процесс")
+        else:
+            print(f"[OK] Порт {port} свободен")
+        print("")
+        return
+    
+    print(f"[!] Порт {port} занят")
+    info = get_process_info(pid)
+    if info:
+        print("Найден процесс:")
+        print(f"  PID:  {info['pid']}")
+        print(f"  Имя:  {info['name']}")
+        print(f"  Путь: {info['path']}")
+        print("")
         
-        if pid:
-            info = get_process_info(pid)
-            if info:
-                print("Найден процесс:")
-                print(f"  PID:  {info['pid']}")
-                print(f"  Имя:  {info['name']}")
-                print(f"  Путь: {info['path']}")
-                print("")
-                
-                response = input("Завершить процесс? (y/n): ")
-                if response.lower() == 'y':
-                    if kill_process(pid):
-                        print("[OK] Процесс завершен!")
-                    else:
-                        print("[ERROR] Не удалось завершить процесс (возможно, нет прав)")
-                else:
-                    print("Отменено.")
+        response = input("Завершить процесс? (y/n): ")
+        if response.lower() == 'y':
+            if kill_process(pid):
+                print("[OK] Процесс завершен!")
             else:
-                print(f"Найден процесс с PID {pid}, но не удалось получить информацию")
+                print("[ERROR] Не удалось завершить процесс (возможно, нет прав)")
         else:
-            print(f"[!] Не удалось найти процесс на порту {port}")
+            print("Отменено.")
     else:
-        print(f"[OK] Порт {port} свободен")
+        print(f"Найден процесс с PID {pid}, но не удалось получить информацию")
     
     print("")
 
 if __name__ == "__main__":
+    # Настраиваем кодировку вывода для Windows (только при запуске как скрипта)
+    if _IS_WINDOWS:
+        sys.stdout.reconfigure(encoding='utf-8')
+        sys.stderr.reconfigure(encoding='utf-8')
+    
     main()
@@ -10,10 +10,13 @@ import os
 import sys
 import subprocess
 import socket
+import errno
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 import webbrowser
 import threading
 
+from kill_port import get_busy_ports
+
 DEFAULT_PORT = 8000
 HOST = "localhost"
 PROJECT_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -53,22 +56,40 @@ def print_header(port):
     print("=" * 40)
     print("")
 
+# Коды ошибок bind(), означающие занятый или зарезервированный порт
+# (на Windows доступ к исключённому диапазону портов даёт WSAEACCES = 10013)
+_PORT_BUSY_ERRNOS = frozenset(
+    code for code in (errno.EADDRINUSE, errno.EACCES, getattr(errno, 'WSAEACCES', None))
+    if code is not None
+)
+
 def check_port_available(host, port):
-    """Проверяет доступность порта"""
+    """Проверяет доступность порта пробным bind()"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(1)
-        result = sock.connect_ex((host, port))
+        # SO_REUSEADDR только на Linux: на Windows и macOS/BSD он позволяет
+        # занять 127.0.0.1:PORT рядом с чужим сокетом, слушающим 0.0.0.0:PORT
+        if sys.platform.startswith('linux'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        return True  # Порт свободен
+    except OSError as e:
+        if e.errno in _PORT_BUSY_ERRNOS:
+            return False
+        raise
+    finally:
         sock.close()
-        return result != 0  # True если порт свободен
-    except Exception:
-        return True  # В случае ошибки считаем порт свободным
 
 def find_free_port(host, start_port, max_attempts=10):
     """Находит свободный порт начиная с start_port"""
-    for i in range(max_attempts):
-        port = start_port + i
-        if check_port_available(host, port):
+    candidates = range(start_port, start_port + max_attempts)
+    
+    # Один запрос к ядру за списком занятых портов (на Mac — пробные подключения)
+    busy = get_busy_ports(candidates)
+    
+    # Кандидата подтверждаем пробным bind(): порт может быть занят без слушающего сокета
+    for port in candidates:
+        if port not in busy and check_port_available(host, port):
             return port
     return None  # Не найдено свободного порта
 
@@ -89,12 +110,6 @@ def check_node_installed():
     print("Убедитесь, что Node.js установлен и добавлен в системную переменную PATH.")
     return False
 
-def open_browser(port):
-    """Открывает браузер через 1 секунду после запуска сервера"""
-    import time
-    time.sleep(1)
-    webbrowser.open(f'http://{HOST}:{port}')
-
 def start_server():
     """Запускает локальный сервер"""
     global PORT
@@ -106,23 +121,19 @@ def start_server():
     if not check_node_installed():
         sys.exit(1)
     
-    # Проверяем порт и ищем свободный если нужно
-    if not check_port_available(HOST, DEFAULT_PORT):
+    # Ищем свободный порт начиная с DEFAULT_PORT: один запрос к ядру на весь диапазон
+    free_port = find_free_port(HOST, DEFAULT_PORT)
+    if free_port != DEFAULT_PORT:
         print(f"⚠️  Порт {DEFAULT_PORT} уже занят!")
-        print("Поиск свободного порта...")
-        
-        free_port = find_free_port(HOST, DEFAULT_PORT)
         if free_port:
-            PORT = free_port
-            print(f"✓ Найден свободный порт: {PORT}")
+            print(f"✓ Найден свободный порт: {free_port}")
             # Обновляем package.json или используем переменную окружения
-            os.environ['PORT'] = str(PORT)
+            os.environ['PORT'] = str(free_port)
         else:
             print("❌ Не удалось найти свободный порт!")
             print("Попробуйте завершить процесс, занимающий порт, или используйте другой порт вручную.")
             sys.exit(1)
-    else:
-        PORT = DEFAULT_PORT
+    PORT = free_port
     
     # Выводим заголовок с правильным портом
     print_header(PORT)
@@ -130,9 +141,10 @@ def start_server():
     print("Запуск сервера...")
     print("")
     
-    # Открываем браузер в отдельном потоке
-    browser_thread = threading.Thread(target=open_browser, args=(PORT,), daemon=True)
-    browser_thread.start()
+    # Открываем браузер через 1 секунду после запуска сервера
+    browser_timer = threading.Timer(1.0, webbrowser.open, args=(f'http://{HOST}:{PORT}',))
+    browser_timer.daemon = True
+    browser_timer.start()
     
     # Запускаем сервер через npm (порт передается через переменную окружения)
     # Но npm скрипт использует фиксированный порт, поэтому нужно изменить команду
@@ -145,6 +157,7 @@ def start_server():
         print(f"Ошибка запуска сервера: {e}")
         sys.exit(1)
     except KeyboardInterrupt:
+        browser_timer.cancel()
         print("\n\nСервер остановлен пользователем.")
         sys.exit(0)
 
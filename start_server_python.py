@@ -10,10 +10,16 @@
 import os
 import sys
 import socket
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+import errno
+import posixpath
+import re
+import urllib.parse
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 import webbrowser
 import threading
 
+from kill_port import get_busy_ports
+
 DEFAULT_PORT = 8000
 HOST = "localhost"
 PROJECT_PATH = os.path.dirname(os.path.abspath(__file__))
@@ -30,19 +36,101 @@ def check_venv():
 class CustomHTTPRequestHandler(SimpleHTTPRequestHandler):
     """Кастомный обработчик запросов с правильными MIME типами"""
     
+    # Заголовки безопасности, сформированные один раз для всех ответов
+    _SECURITY_HEADERS = (
+        b'X-Content-Type-Options: nosniff\r\n'
+        b'X-Frame-Options: SAMEORIGIN\r\n'
+        b'X-XSS-Protection: 1; mode=block\r\n'
+    )
+    
+    # MIME типы для основных расширений проекта (без обращения к mimetypes)
+    _EXT_MAP = {
+        '.html': 'text/html; charset=utf-8',
+        '.js': 'application/javascript',
+        '.css': 'text/css',
+        '.json': 'application/json',
+        '.md': 'text/markdown; charset=utf-8',
+        '.svg': 'image/svg+xml',
+        '.png': 'image/png',
+        '.woff': 'font/woff',
+        '.woff2': 'font/woff2',
+        '.wasm': 'application/wasm',
+    }
+    
+    # Расширения неизменяемых ресурсов, которые браузер может кэшировать
+    _CACHEABLE_EXTS = frozenset({'.woff', '.woff2', '.eot', '.png', '.jpg', '.jpeg', '.gif', '.ico', '.svg'})
+    
+    # Корень сайта и правила отбрасывания сегментов пути
+    _ROOT = PROJECT_PATH
+    _SKIP_SEGMENTS = frozenset(('', os.curdir, os.pardir))
+    _UNSAFE_SEGMENT = re.compile(r'[\\:]') if os.name == 'nt' else None
+    
+    # TCP_NODELAY: маленькие ответы уходят сразу, без ожидания алгоритма Нейгла
+    disable_nagle_algorithm = True
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, directory=PROJECT_PATH, **kwargs)
     
+    def translate_path(self, path):
+        """Преобразует URL-путь в путь к файлу внутри PROJECT_PATH"""
+        path = path.split('?', 1)[0].split('#', 1)[0]
+        trailing_slash = path.rstrip().endswith('/')
+        try:
+            path = urllib.parse.unquote(path, errors='surrogatepass')
+        except UnicodeDecodeError:
+            path = urllib.parse.unquote(path)
+        
+        # Отбрасываем ".", ".." и (на Windows) сегменты с диском или обратной косой чертой
+        words = [
+            word for word in posixpath.normpath(path).split('/')
+            if word not in self._SKIP_SEGMENTS
+            and not (self._UNSAFE_SEGMENT and self._UNSAFE_SEGMENT.search(word))
+        ]
+        path = os.sep.join((self._ROOT, *words))
+        if trailing_slash:
+            path += '/'
+        return path
+    
+    @staticmethod
+    def _extension(path):
+        """Возвращает расширение файла в нижнем регистре (вместе с точкой)"""
+        return path[path.rfind('.'):].lower()
+    
+    def guess_type(self, path):
+        """Определяет MIME тип по таблице расширений, иначе стандартным способом"""
+        return self._EXT_MAP.get(self._extension(path)) or super().guess_type(path)
+    
+    def send_response(self, code, message=None):
+        super().send_response(code, message)
+        # Разрешаем кэширование шрифтов и изображений, чтобы не запрашивать их повторно
+        if code == 200:
+            path = self.path.split('?', 1)[0].split('#', 1)[0]
+            if self._extension(path) in self._CACHEABLE_EXTS:
+                self.send_header('Cache-Control', 'public, max-age=3600')
+    
+    def copyfile(self, source, outputfile):
+        """Отправляет файл через sendfile(), минуя буферы Python"""
+        if hasattr(os, 'sendfile') and outputfile is self.wfile:
+            try:
+                source.fileno()
+            except (AttributeError, OSError):
+                pass  # Не настоящий файл (например, листинг директории в памяти)
+            else:
+                self.connection.sendfile(source)
+                return
+        super().copyfile(source, outputfile)
+    
     def end_headers(self):
-        # Добавляем заголовки безопасности
-        self.send_header('X-Content-Type-Options', 'nosniff')
-        self.send_header('X-Frame-Options', 'SAMEORIGIN')
-        self.send_header('X-XSS-Protection', '1; mode=block')
+        # Добавляем заголовки безопасности в общий буфер, который
+        # super().end_headers() отправляет одной записью
+        if self.request_version != 'HTTP/0.9':
+            self._headers_buffer.append(self._SECURITY_HEADERS)
         super().end_headers()
     
     def log_message(self, format, *args):
         """Кастомное логирование запросов"""
-        print(f"[{self.address_string()}] {format % args}")
+        # Одна запись на строку: строки из разных потоков не перемешиваются
+        sys.stdout.write(f"[{self.address_string()}] {format % args}\n")
 
 def print_header(port):
     """Выводит заголовок с информацией о сервере"""
@@ -60,31 +148,43 @@ def print_header(port):
     print("=" * 40)
     print("")
 
+# Коды ошибок bind(), означающие занятый или зарезервированный порт
+# (на Windows доступ к исключённому диапазону портов даёт WSAEACCES = 10013)
+_PORT_BUSY_ERRNOS = frozenset(
+    code for code in (errno.EADDRINUSE, errno.EACCES, getattr(errno, 'WSAEACCES', None))
+    if code is not None
+)
+
 def check_port_available(host, port):
-    """Проверяет доступность порта"""
+    """Проверяет доступность порта пробным bind()"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(1)
-        result = sock.connect_ex((host, port))
+        # SO_REUSEADDR только на Linux: на Windows и macOS/BSD он позволяет
+        # занять 127.0.0.1:PORT рядом с чужим сокетом, слушающим 0.0.0.0:PORT
+        if sys.platform.startswith('linux'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        return True  # Порт свободен
+    except OSError as e:
+        if e.errno in _PORT_BUSY_ERRNOS:
+            return False
+        raise
+    finally:
         sock.close()
-        return result != 0  # True если порт свободен
-    except Exception:
-        return True  # В случае ошибки считаем порт свободным
 
 def find_free_port(host, start_port, max_attempts=10):
     """Находит свободный порт начиная с start_port"""
-    for i in range(max_attempts):
-        port = start_port + i
-        if check_port_available(host, port):
+    candidates = range(start_port, start_port + max_attempts)
+    
+    # Один запрос к ядру за списком занятых портов (на Mac — пробные подключения)
+    busy = get_busy_ports(candidates)
+    
+    # Кандидата подтверждаем пробным bind(): порт может быть занят без слушающего сокета
+    for port in candidates:
+        if port not in busy and check_port_available(host, port):
             return port
     return None  # Не найдено свободного порта
 
-def open_browser(port):
-    """Открывает браузер через 1 секунду после запуска сервера"""
-    import time
-    time.sleep(1)
-    webbrowser.open(f'http://{HOST}:{port}')
-
 def start_server():
     """Запускает локальный сервер"""
     global PORT
@@ -92,21 +192,17 @@ def start_server():
     # Переходим в директорию проекта
     os.chdir(PROJECT_PATH)
     
-    # Проверяем порт и ищем свободный если нужно
-    if not check_port_available(HOST, DEFAULT_PORT):
+    # Ищем свободный порт начиная с DEFAULT_PORT: один запрос к ядру на весь диапазон
+    free_port = find_free_port(HOST, DEFAULT_PORT)
+    if free_port != DEFAULT_PORT:
         print(f"⚠️  Порт {DEFAULT_PORT} уже занят!")
-        print("Поиск свободного порта...")
-        
-        free_port = find_free_port(HOST, DEFAULT_PORT)
         if free_port:
-            PORT = free_port
-            print(f"✓ Найден свободный порт: {PORT}")
+            print(f"✓ Найден свободный порт: {free_port}")
         else:
             print("❌ Не удалось найти свободный порт!")
             print("Попробуйте завершить процесс, занимающий порт, или используйте другой порт вручную.")
             sys.exit(1)
-    else:
-        PORT = DEFAULT_PORT
+    PORT = free_port
     
     # Выводим заголовок с правильным портом
     print_header(PORT)
@@ -117,14 +213,16 @@ def start_server():
     # Создаем сервер
     server_address = (HOST, PORT)
     try:
-        httpd = HTTPServer(server_address, CustomHTTPRequestHandler)
+        # Многопоточный сервер: медленный запрос не блокирует остальные
+        httpd = ThreadingHTTPServer(server_address, CustomHTTPRequestHandler)
     except OSError as e:
         print(f"❌ Ошибка запуска сервера: {e}")
         sys.exit(1)
     
-    # Открываем браузер в отдельном потоке
-    browser_thread = threading.Thread(target=open_browser, args=(PORT,), daemon=True)
-    browser_thread.start()
+    # Открываем браузер через 1 секунду после запуска сервера
+    browser_timer = threading.Timer(1.0, webbrowser.open, args=(f'http://{HOST}:{PORT}',))
+    browser_timer.daemon = True
+    browser_timer.start()
     
     print(f"✓ Сервер запущен на http://{HOST}:{PORT}")
     print("")
@@ -133,6 +231,7 @@ def start_server():
         # Запускаем сервер
         httpd.serve_forever()
     except KeyboardInterrupt:
+        browser_timer.cancel()
         print("\n\nОстановка сервера...")
         httpd.shutdown()
         print("Сервер остановлен.")